@@ -0,0 +1,10 @@
+"""Маршруты админки. Модуль подключается через include() по имени, поэтому он
+импортируется (а admin.py приложений регистрируются) только при первом запросе к /admin/"""
+from django.contrib import admin
+from django.urls import path
+
+admin.autodiscover()
+
+urlpatterns = [
+    path('', admin.site.urls),
+]
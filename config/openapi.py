@@ -0,0 +1,105 @@
+"""OpenAPI документ API.
+
+Схема генерируется заранее командой build_openapi_schema и отдается как статический
+файл с ETag и Cache-Control. Страницы swagger/redoc рендерятся из шаблонов drf_yasg
+и загружают этот файл. drf_yasg импортируется только при генерации схемы и при
+первом открытии документации, а не при старте каждого воркера.
+"""
+import hashlib
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+
+
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="API Documentation",
+        default_version='v1',
+        description="Your API description",
+        terms_of_service="https://www.example.com/policies/terms/",
+        contact=openapi.Contact(email="contact@example.com"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def generate_schema():
+    """OpenAPI документ в JSON (bytes) для всех эндпоинтов"""
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    schema = OpenAPISchemaGenerator(api_info()).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    path = str(path or settings.OPENAPI_SCHEMA_PATH)
+    content = generate_schema()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as schema_file:
+        schema_file.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+@lru_cache(maxsize=1)
+def load_schema():
+    """Содержимое схемы и ее ETag. Если файл не собран, генерируем и сохраняем его один раз"""
+    path = str(settings.OPENAPI_SCHEMA_PATH)
+    try:
+        with open(path, 'rb') as schema_file:
+            content = schema_file.read()
+    except FileNotFoundError:
+        write_schema(path)
+        with open(path, 'rb') as schema_file:
+            content = schema_file.read()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+@condition(etag_func=lambda request: load_schema()[1])
+def schema_response(request):
+    content, _ = load_schema()
+    return HttpResponse(content, content_type='application/json')
+
+
+@require_GET
+def openapi_schema(request):
+    # заголовки кеширования нужны и ответу 200, и ответу 304 от condition
+    response = schema_response(request)
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response
+
+
+def render_ui(request, renderer_class, **cache_control):
+    """Страница swagger/redoc из шаблона drf_yasg. Схему она загружает с SPEC_URL (/openapi.json),
+    поэтому при открытии документации схема не генерируется"""
+    context = {'request': request}
+    renderer = renderer_class()
+    renderer.set_context(context)
+    context['title'] = api_info().title
+
+    response = HttpResponse(render_to_string(renderer.template, context, request))
+    patch_cache_control(response, max_age=settings.OPENAPI_SCHEMA_MAX_AGE, **cache_control)
+    return response
+
+
+@require_GET
+def swagger_ui(request):
+    from drf_yasg.renderers import SwaggerUIRenderer
+
+    # страница содержит CSRF токен и имя пользователя (USE_SESSION_AUTH), общим кешам ее отдавать нельзя
+    return render_ui(request, SwaggerUIRenderer, private=True)
+
+
+@require_GET
+def redoc_ui(request):
+    from drf_yasg.renderers import ReDocRenderer
+
+    return render_ui(request, ReDocRenderer, public=True)
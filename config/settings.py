@@ -25,7 +25,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    "django.contrib.admin",
+    # без autodiscover при старте, admin.py подключаются в config/admin_urls.py
+    "django.contrib.admin.apps.SimpleAdminConfig",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
@@ -47,6 +48,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "wallet.middleware.WalletTrafficCaptureMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -124,6 +126,43 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Запись трафика кошельков для нагрузочного воспроизведения (replay_traffic)
+# Пустое значение отключает WalletTrafficCaptureMiddleware
+
+WALLET_TRAFFIC_CAPTURE = os.getenv('WALLET_TRAFFIC_CAPTURE')
+WALLET_TRAFFIC_CAPTURE_BUFFER = int(os.getenv('WALLET_TRAFFIC_CAPTURE_BUFFER', 256))
+
+# Отчет операционной аналитики (manage.py wallet_analytics)
+
+WALLET_ANALYTICS_REPORT = os.getenv('WALLET_ANALYTICS_REPORT') or str(BASE_DIR / 'var' / 'analytics.json')
+
+# Архив старой истории операций (manage.py archive_operations)
+
+WALLET_ARCHIVE_DIR = os.getenv('WALLET_ARCHIVE_DIR') or str(BASE_DIR / 'var' / 'archive')
+WALLET_ARCHIVE_RETENTION_DAYS = int(os.getenv('WALLET_ARCHIVE_RETENTION_DAYS') or 90)
+
+# Фильтр Блума по существующим кошелькам: 404 для неизвестных UUID без запроса в БД
+# WALLET_FILTER_PATH - общий для воркеров файл фильтра (mmap)
+
+WALLET_FILTER_ENABLED = True if os.getenv('WALLET_FILTER_ENABLED') == 'True' else False
+WALLET_FILTER_PATH = os.getenv('WALLET_FILTER_PATH') or str(BASE_DIR / 'var' / 'wallets.bloom')
+WALLET_FILTER_CAPACITY = int(os.getenv('WALLET_FILTER_CAPACITY') or 1_000_000)
+WALLET_FILTER_ERROR_RATE = float(os.getenv('WALLET_FILTER_ERROR_RATE') or 0.001)
+WALLET_FILTER_REFRESH_SECONDS = float(os.getenv('WALLET_FILTER_REFRESH_SECONDS') or 5)
+
+# Заранее собранная OpenAPI схема (manage.py build_openapi_schema)
+
+OPENAPI_SCHEMA_PATH = os.getenv('OPENAPI_SCHEMA_PATH') or str(BASE_DIR / 'var' / 'openapi.json')
+OPENAPI_SCHEMA_MAX_AGE = 60 * 60
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'openapi-schema',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'openapi-schema',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,27 +1,15 @@
-from django.contrib import admin
-from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from django.urls import URLResolver, path, include
+from django.urls.resolvers import RoutePattern
 
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="API Documentation",
-        default_version='v1',
-        description="Your API description",
-        terms_of_service="https://www.example.com/policies/terms/",
-        contact=openapi.Contact(email="contact@example.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from config.openapi import openapi_schema, redoc_ui, swagger_ui
 
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
+    # include() импортирует модуль сразу, а URLResolver с именем модуля - при первом обращении к его маршрутам:
+    # запросе к /admin/ или любом reverse() (HTML ответ browsable API, страницы документации)
+    URLResolver(RoutePattern('admin/', is_endpoint=False), 'config.admin_urls'),
     path('', include('wallet.urls')),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('openapi.json', openapi_schema, name='openapi-schema'),
+    path('swagger/', swagger_ui, name='schema-swagger-ui'),
+    path('redoc/', redoc_ui, name='schema-redoc'),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Wallet
+from .models import Operation, Wallet
 
 
 @admin.register(Wallet)
@@ -7,3 +7,10 @@ class WalletAdmin(admin.ModelAdmin):
     list_display = ['id', 'amount', 'at_create', 'time_update']
     search_fields = ['id']
 
+
+@admin.register(Operation)
+class OperationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'wallet', 'operation_type', 'amount', 'created_at']
+    list_filter = ['operation_type']
+    search_fields = ['wallet__id']
+    raw_id_fields = ['wallet']
@@ -0,0 +1,205 @@
+"""Операционная аналитика по кошелькам.
+
+Данные читаются серверным курсором порциями по chunk_size строк и сразу
+сворачиваются в pandas/NumPy, поэтому память не зависит от размера таблиц.
+Дневные объемы накапливаются в DailyOperationStats инкрементально.
+"""
+import json
+import os
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from django.utils import timezone
+
+from wallet.models import DailyOperationStats, Operation, RollupWatermark, Wallet
+
+CHUNK_SIZE = 50_000
+
+# Запас на транзакции, которые еще не закоммичены: операции моложе него дневные агрегаты не берут
+ROLLUP_LAG = timedelta(minutes=5)
+
+# Границы корзин распределения балансов в копейках, последняя корзина открыта сверху
+BALANCE_BUCKETS = np.array([0, 1, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000], dtype=np.int64)
+
+
+def iter_frames(sql, params, columns, chunk_size=CHUNK_SIZE):
+    """Читаем результат запроса порциями в DataFrame.
+
+    На PostgreSQL chunked_cursor - это именованный (серверный) курсор,
+    клиент держит в памяти не больше chunk_size строк.
+    """
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def cents_to_decimal(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def add_daily_totals(totals):
+    """Прибавляем свернутые (день, тип операции) -> count, cents к DailyOperationStats"""
+    for day, day_totals in totals.groupby(level=0):
+        stats, _ = DailyOperationStats.objects.select_for_update().get_or_create(day=day)
+        for (_, operation_type), row in day_totals.iterrows():
+            if operation_type == 'DEPOSIT':
+                stats.deposit_count += int(row['count'])
+                stats.deposit_volume += cents_to_decimal(row['cents'])
+            elif operation_type == 'WITHDRAW':
+                stats.withdraw_count += int(row['count'])
+                stats.withdraw_volume += cents_to_decimal(row['cents'])
+        stats.save()
+
+
+def update_daily_rollups(chunk_size=CHUNK_SIZE, lag=ROLLUP_LAG):
+    """Досчитываем дневные агрегаты по операциям, появившимся после прошлого запуска.
+
+    Берем операции с created_at в [граница прошлого запуска, now() - lag). Граница
+    идет по времени, а не по id: id выдаются при вставке, и транзакция с меньшим
+    id может закоммититься позже большего - счетчик по id такую операцию потерял бы.
+    Операция попадает в отчет через lag после создания, если ее транзакция
+    успела закоммититься за это время.
+
+    Граница читается и сдвигается под блокировкой строки RollupWatermark: второй
+    одновременный запуск (wallet_analytics и archive_operations) ждет первого и
+    продолжает уже с его границы.
+
+    Возвращает количество обработанных операций.
+    """
+    with transaction.atomic():
+        watermark = RollupWatermark.objects.select_for_update().get_or_create(pk=1)[0]
+        since = watermark.rolled_up_until
+        until = timezone.now() - lag
+        if since is not None and since >= until:
+            return 0
+
+        conditions, params = ['created_at < %s'], [until]
+        if since is not None:
+            conditions.append('created_at >= %s')
+            params.append(since)
+        sql = (
+            f'SELECT id, operation_type, created_at, CAST(ROUND(amount * 100) AS BIGINT) '
+            f'FROM {Operation._meta.db_table} WHERE {" AND ".join(conditions)} ORDER BY created_at'
+        )
+
+        totals = None
+        processed = 0
+        for frame in iter_frames(sql, params, ['id', 'operation_type', 'created_at', 'cents'], chunk_size):
+            processed += len(frame)
+            frame['day'] = pd.to_datetime(frame['created_at'], utc=True).dt.date
+            grouped = frame.groupby(['day', 'operation_type']).agg(count=('id', 'size'), cents=('cents', 'sum'))
+            if totals is not None:
+                grouped = pd.concat([totals, grouped]).groupby(level=[0, 1]).sum()
+            totals = grouped
+
+        if totals is not None:
+            add_daily_totals(totals)
+        watermark.rolled_up_until = until
+        watermark.save()
+
+    return processed
+
+
+def balance_distribution(chunk_size=CHUNK_SIZE):
+    """Распределение балансов по корзинам и сводные показатели за один проход по wallets"""
+    counts = np.zeros(len(BALANCE_BUCKETS), dtype=np.int64)
+    total_count = 0
+    total_cents = 0
+    minimum = maximum = None
+
+    sql = f'SELECT CAST(ROUND(amount * 100) AS BIGINT) FROM {Wallet._meta.db_table}'
+    for frame in iter_frames(sql, [], ['cents'], chunk_size):
+        values = frame['cents'].to_numpy(dtype=np.int64)
+        buckets = np.searchsorted(BALANCE_BUCKETS, values, side='right') - 1
+        counts += np.bincount(buckets, minlength=len(BALANCE_BUCKETS))
+        total_count += len(values)
+        total_cents += int(values.sum())
+        minimum = int(values.min()) if minimum is None else min(minimum, int(values.min()))
+        maximum = int(values.max()) if maximum is None else max(maximum, int(values.max()))
+
+    edges = list(BALANCE_BUCKETS) + [None]
+    return {
+        'count': total_count,
+        'total': str(cents_to_decimal(total_cents)),
+        'mean': str(cents_to_decimal(total_cents // total_count)) if total_count else None,
+        'min': str(cents_to_decimal(minimum)) if minimum is not None else None,
+        'max': str(cents_to_decimal(maximum)) if maximum is not None else None,
+        'buckets': [
+            {
+                'from': str(cents_to_decimal(edges[index])),
+                'to': str(cents_to_decimal(edges[index + 1])) if edges[index + 1] is not None else None,
+                'count': int(count),
+            }
+            for index, count in enumerate(counts)
+        ],
+    }
+
+
+def top_active_wallets(limit=10, days=7, chunk_size=CHUNK_SIZE, capacity=None):
+    """Самые активные кошельки по числу операций за последние days дней.
+
+    Счетчики ограничены capacity записями: при переполнении остаются только
+    самые частые кошельки, и результат помечается как приблизительный.
+    """
+    capacity = capacity or max(limit * 100, 100_000)
+    since = timezone.now() - timedelta(days=days)
+    sql = f'SELECT wallet_id FROM {Operation._meta.db_table} WHERE created_at >= %s'
+
+    counts = pd.Series(dtype=np.int64)
+    approximate = False
+    for frame in iter_frames(sql, [since], ['wallet_id'], chunk_size):
+        counts = counts.add(frame['wallet_id'].value_counts(), fill_value=0)
+        if len(counts) > capacity:
+            counts = counts.nlargest(capacity)
+            approximate = True
+
+    to_uuid = Wallet._meta.pk.to_python
+    return {
+        'days': days,
+        'approximate': approximate,
+        'wallets': [
+            {'id': str(to_uuid(wallet_id)), 'operations': int(count)}
+            for wallet_id, count in counts.nlargest(limit).items()
+        ],
+    }
+
+
+def daily_stats(days=30):
+    since = timezone.now().date() - timedelta(days=days)
+    return [
+        {
+            'day': stats.day.isoformat(),
+            'deposit_count': stats.deposit_count,
+            'deposit_volume': str(stats.deposit_volume),
+            'withdraw_count': stats.withdraw_count,
+            'withdraw_volume': str(stats.withdraw_volume),
+        }
+        for stats in DailyOperationStats.objects.filter(day__gte=since).order_by('day')
+    ]
+
+
+def build_report(top=10, active_days=7, daily_days=30, chunk_size=CHUNK_SIZE):
+    processed = update_daily_rollups(chunk_size)
+    return {
+        'generated_at': timezone.now().isoformat(),
+        'processed_operations': processed,
+        'daily': daily_stats(daily_days),
+        'balances': balance_distribution(chunk_size),
+        'top_active_wallets': top_active_wallets(top, active_days, chunk_size),
+    }
+
+
+def write_report(report, path):
+    """Атомарно записываем отчет, чтобы эндпоинт не прочитал недописанный файл"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class WalletConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "wallet"
+
+    def ready(self):
+        from django.db.models.signals import post_save
+        from wallet.bloom import open_wallet_filter, wallet_created
+        from wallet.models import Wallet
+
+        post_save.connect(wallet_created, sender=Wallet, dispatch_uid='wallet_filter_created')
+        open_wallet_filter()
@@ -0,0 +1,338 @@
+"""Холодное хранение старой истории операций.
+
+Операции старше WALLET_ARCHIVE_RETENTION_DAYS переносятся из таблицы operations
+в неизменяемые файлы-сегменты в WALLET_ARCHIVE_DIR. Устройство сегмента:
+
+    заголовок | блоки zstd | индекс
+
+Записи внутри сегмента отсортированы по (кошелек, время), каждый блок содержит
+операции одного кошелька и сжат отдельно. Индекс в конце файла - отсортированный
+по UUID кошелька массив (кошелек, мин. время, макс. время, смещение, длина, число записей),
+поэтому чтение истории одного кошелька - это бинарный поиск по mmap и распаковка
+только нужных блоков.
+"""
+import heapq
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import zstandard
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from wallet.models import Operation, RollupWatermark
+
+SEGMENT_MAGIC = b'WSEG'
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = '.wseg'
+
+# magic, версия, резерв, граница архивации, первый и последний id, мин. и макс. время, смещение индекса, число блоков
+HEADER_FORMAT = struct.Struct('<4sHHqqqqqQI')
+# UUID кошелька, мин. и макс. время, смещение блока, длина блока, число записей
+INDEX_FORMAT = struct.Struct('<16sqqQII')
+# id, время в мкс, тип операции, сумма в копейках
+RECORD_FORMAT = struct.Struct('<qqBq')
+
+BLOCK_RECORDS = 4096
+COMPRESSION_LEVEL = 9
+
+OPERATION_CODES = {'DEPOSIT': 1, 'WITHDRAW': 2}
+OPERATION_TYPES = {code: operation_type for operation_type, code in OPERATION_CODES.items()}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+ArchivedOperation = namedtuple('ArchivedOperation', ['id', 'wallet_id', 'operation_type', 'amount', 'created_at'])
+SegmentHeader = namedtuple('SegmentHeader', [
+    'magic', 'version', 'reserved', 'cutoff', 'first_id', 'last_id', 'min_ts', 'max_ts', 'index_offset', 'entries',
+])
+
+
+def to_micros(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def to_cents(amount):
+    return int((amount * 100).to_integral_value())
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
+
+
+def segment_name(first_id, last_id):
+    return f'segment-{first_id:020d}-{last_id:020d}{SEGMENT_SUFFIX}'
+
+
+def write_segment(directory, rows, cutoff):
+    """Пишем сегмент из строк (id, wallet_id, operation_type, amount, created_at).
+
+    Файл сначала пишется во временный и публикуется переименованием,
+    поэтому читатель никогда не видит недописанный сегмент.
+    """
+    rows = sorted(rows, key=lambda row: (row[1].bytes, row[4], row[0]))
+    first_id = min(row[0] for row in rows)
+    last_id = max(row[0] for row in rows)
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+
+    path = os.path.join(directory, segment_name(first_id, last_id))
+    tmp_path = f'{path}.tmp'
+    index = []
+    with open(tmp_path, 'wb') as segment:
+        segment.write(b'\0' * HEADER_FORMAT.size)
+        offset = HEADER_FORMAT.size
+
+        start = 0
+        while start < len(rows):
+            wallet_id = rows[start][1]
+            end = start
+            while end < len(rows) and end - start < BLOCK_RECORDS and rows[end][1] == wallet_id:
+                end += 1
+
+            block_rows = rows[start:end]
+            payload = b''.join(
+                RECORD_FORMAT.pack(op_id, to_micros(created_at), OPERATION_CODES[operation_type], to_cents(amount))
+                for op_id, _, operation_type, amount, created_at in block_rows
+            )
+            block = compressor.compress(payload)
+            segment.write(block)
+            index.append(INDEX_FORMAT.pack(
+                wallet_id.bytes,
+                to_micros(block_rows[0][4]),
+                to_micros(block_rows[-1][4]),
+                offset,
+                len(block),
+                len(block_rows),
+            ))
+            offset += len(block)
+            start = end
+
+        segment.write(b''.join(index))
+        segment.seek(0)
+        segment.write(HEADER_FORMAT.pack(
+            SEGMENT_MAGIC, SEGMENT_VERSION, 0, to_micros(cutoff), first_id, last_id,
+            min(to_micros(row[4]) for row in rows), max(to_micros(row[4]) for row in rows),
+            offset, len(index),
+        ))
+        segment.flush()
+        os.fsync(segment.fileno())
+
+    os.replace(tmp_path, path)
+    return path
+
+
+class Segment:
+    """Сегмент, отображенный в память"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment_file:
+            self.mm = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = SegmentHeader(*HEADER_FORMAT.unpack_from(self.mm, 0))
+        if self.header.magic != SEGMENT_MAGIC or self.header.version != SEGMENT_VERSION:
+            raise ValueError(f'{path}: неизвестный формат сегмента')
+
+    def entry(self, position):
+        return INDEX_FORMAT.unpack_from(self.mm, self.header.index_offset + position * INDEX_FORMAT.size)
+
+    def first_entry(self, wallet_bytes):
+        """Бинарный поиск первого блока кошелька в индексе"""
+        low, high = 0, self.header.entries
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < wallet_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def operations(self, wallet_id, since=None, until=None):
+        """Операции кошелька с since <= created_at <= until (границы в мкс)"""
+        if since is not None and self.header.max_ts < since:
+            return
+        if until is not None and self.header.min_ts > until:
+            return
+
+        decompressor = zstandard.ZstdDecompressor()
+        wallet_bytes = wallet_id.bytes
+        position = self.first_entry(wallet_bytes)
+        while position < self.header.entries:
+            entry_wallet, min_ts, max_ts, offset, length, count = self.entry(position)
+            if entry_wallet != wallet_bytes:
+                break
+            position += 1
+            if (since is not None and max_ts < since) or (until is not None and min_ts > until):
+                continue
+
+            payload = decompressor.decompress(self.mm[offset:offset + length])
+            for op_id, created_at, code, cents in RECORD_FORMAT.iter_unpack(payload):
+                if (since is None or created_at >= since) and (until is None or created_at <= until):
+                    yield ArchivedOperation(
+                        op_id, wallet_id, OPERATION_TYPES[code], from_cents(cents), from_micros(created_at))
+
+    def close(self):
+        self.mm.close()
+
+
+class OperationArchive:
+    """Читатель каталога сегментов. Новые сегменты подхватываются при каждом запросе"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        with self._lock:
+            for name in names:
+                if name not in self._segments:
+                    self._segments[name] = Segment(os.path.join(self.directory, name))
+            return [self._segments[name] for name in names]
+
+    def iter_history(self, wallet_id, since=None, until=None):
+        since_us = to_micros(since) if since is not None else None
+        until_us = to_micros(until) if until is not None else None
+        for segment in self.segments():
+            yield from segment.operations(wallet_id, since_us, until_us)
+
+    def history(self, wallet_id, since=None, until=None):
+        return list(self.iter_history(wallet_id, since, until))
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+
+_archives = {}
+
+
+def get_archive():
+    directory = str(settings.WALLET_ARCHIVE_DIR)
+    if directory not in _archives:
+        _archives[directory] = OperationArchive(directory)
+    return _archives[directory]
+
+
+def history_key(operation):
+    return operation.created_at, operation.id
+
+
+def wallet_history(wallet_id, since=None, until=None, after_id=None, limit=None):
+    """История операций кошелька из архива и рабочей таблицы, по возрастанию (время, id).
+
+    after_id - курсор следующей страницы: из операций в момент since пропускаются
+    операции с id <= after_id. limit - сколько первых операций вернуть.
+
+    Операция может оказаться в обоих местах, если архивация прервалась между
+    записью сегмента и удалением строк, поэтому дубликаты отсекаются по id.
+    """
+    archived = get_archive().iter_history(wallet_id, since, until)
+    if after_id is not None and since is not None:
+        archived = (operation for operation in archived
+                    if operation.created_at != since or operation.id > after_id)
+    if limit is not None:
+        archived = heapq.nsmallest(limit, archived, key=history_key)
+    operations = {operation.id: operation for operation in archived}
+
+    hot = Operation.objects.filter(wallet_id=wallet_id)
+    if since is not None:
+        hot = hot.filter(created_at__gte=since)
+        if after_id is not None:
+            hot = hot.exclude(created_at=since, id__lte=after_id)
+    if until is not None:
+        hot = hot.filter(created_at__lte=until)
+    hot = hot.order_by('created_at', 'id')
+    if limit is not None:
+        hot = hot[:limit]
+    for op_id, operation_type, amount, created_at in hot.values_list('id', 'operation_type', 'amount', 'created_at'):
+        operations[op_id] = ArchivedOperation(op_id, wallet_id, operation_type, amount, created_at)
+
+    return sorted(operations.values(), key=history_key)[:limit]
+
+
+def balance_at(wallet, moment):
+    """Баланс кошелька на момент moment: текущий баланс минус операции после него.
+
+    Операции рабочей таблицы суммируются в БД, архивные - потоком по блокам,
+    без накопления строк. Строки старше границы архива, еще не удаленные из
+    таблицы (прерванная архивация), учитываются только по таблице.
+    """
+    signs = {'DEPOSIT': -1, 'WITHDRAW': 1}
+    balance = wallet.amount
+
+    live = Operation.objects.filter(wallet_id=wallet.id, created_at__gt=moment).order_by()
+    for operation_type, total in live.values_list('operation_type').annotate(total=Sum('amount')):
+        balance += signs[operation_type] * total
+
+    archive = get_archive()
+    segments = archive.segments()
+    if not segments:
+        return balance.quantize(Decimal('0.01'))
+    boundary = from_micros(max(segment.header.cutoff for segment in segments))
+    pending = set(live.filter(created_at__lt=boundary).values_list('id', flat=True))
+    for operation in archive.iter_history(wallet.id, since=moment + timedelta(microseconds=1)):
+        if operation.id not in pending:
+            balance += signs[operation.operation_type] * operation.amount
+    return balance.quantize(Decimal('0.01'))
+
+
+def archive_operations(retention_days=None, batch_size=500_000, directory=None):
+    """Переносим операции старше срока хранения в сегменты, по сегменту на batch_size операций.
+
+    Перед удалением досчитываются дневные агрегаты, и архивируются только
+    операции, которые в них уже учтены (created_at < rolled_up_until).
+
+    Возвращает список путей созданных сегментов.
+    """
+    # pandas нужен только здесь, воркеры API его не загружают
+    from wallet.analytics import update_daily_rollups
+
+    directory = str(directory or settings.WALLET_ARCHIVE_DIR)
+    retention_days = settings.WALLET_ARCHIVE_RETENTION_DAYS if retention_days is None else retention_days
+    os.makedirs(directory, exist_ok=True)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    archive = OperationArchive(directory)
+    segments = archive.segments()
+    # дочищаем строки последнего сегмента, если прошлый запуск прервался до удаления
+    if segments:
+        header = segments[-1].header
+        Operation.objects.filter(
+            id__gte=header.first_id, id__lte=header.last_id, created_at__lt=from_micros(header.cutoff)).delete()
+    archive.close()
+
+    update_daily_rollups()
+    rolled_up_until = RollupWatermark.objects.filter(pk=1).values_list('rolled_up_until', flat=True).first()
+    if rolled_up_until is None:
+        return []
+    cutoff = min(cutoff, rolled_up_until)
+
+    created = []
+    last_id = 0
+    while True:
+        rows = list(
+            Operation.objects.filter(created_at__lt=cutoff, id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'wallet_id', 'operation_type', 'amount', 'created_at')[:batch_size]
+        )
+        if not rows:
+            break
+
+        created.append(write_segment(directory, rows, cutoff))
+        first_id, last_id = rows[0][0], rows[-1][0]
+        Operation.objects.filter(id__gte=first_id, id__lte=last_id, created_at__lt=cutoff).delete()
+
+    return created
@@ -0,0 +1,321 @@
+"""Фильтр Блума по UUID существующих кошельков.
+
+Позволяет отвечать 404 на запросы к заведомо несуществующим кошелькам без
+обращения к базе. Ложноотрицательных ответов быть не должно, поэтому:
+
+- биты лежат в файле WALLET_FILTER_PATH, общем для всех воркеров хоста через mmap:
+  воркер стартует без перестроения, а кошелек, добавленный одним воркером
+  (сигнал post_save), сразу виден остальным;
+- кошельки, созданные в обход сигналов (bulk_create, другие хосты), подтягиваются
+  догоняющим запросом по времени создания: если с последней синхронизации файла
+  прошло больше WALLET_FILTER_REFRESH_SECONDS, промах фильтра не отклоняется сразу,
+  а сначала проверяется этим запросом (один на хост, под файловой блокировкой).
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+FILTER_MAGIC = b'WBLM'
+FILTER_VERSION = 2
+# magic, версия, резерв, число бит, число хеш-функций, резерв, время синхронизации, добавлено элементов,
+# счетчики всех воркеров: проверено, отсеяно, ложных срабатываний
+HEADER_FORMAT = struct.Struct('<4sHHQIIdQQQQ')
+SYNCED_AT, ADDED, CHECKS, REJECTED, FALSE_POSITIVES = 6, 7, 8, 9, 10
+
+# запас на расхождение часов между хостами при догоняющем запросе
+SYNC_SKEW = timedelta(seconds=60)
+BUILD_CHUNK_SIZE = 50_000
+# счетчики процесса переносятся в заголовок файла раз в столько проверок
+STATS_FLUSH_EVERY = 1000
+
+
+def filter_size(capacity, error_rate):
+    """Число бит и хеш-функций для заданной емкости и доли ложных срабатываний"""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class WalletFilter:
+    """Битовый массив фильтра в mmap общего файла с заголовком HEADER_FORMAT"""
+
+    def __init__(self, mm, shared_file, refresh_seconds=5.0):
+        self.mm = mm
+        self.shared_file = shared_file
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # догоняющий запрос идет под отдельной блокировкой: add_many внутри него берет блокировку записи
+        self._refresh_lock = threading.Lock()
+        self._refresh_file = open(f'{shared_file.name}.lock', 'a')
+
+        magic, version, _, self.bits, self.hashes, *_ = HEADER_FORMAT.unpack_from(mm, 0)
+        if magic != FILTER_MAGIC or version != FILTER_VERSION:
+            self.close()
+            raise ValueError('Неизвестный формат файла фильтра')
+
+        # счетчики процесса, еще не перенесенные в заголовок: проверено, отсеяно, ложных срабатываний
+        self._stats_lock = threading.Lock()
+        self._pending = [0, 0, 0]
+
+    @classmethod
+    def create(cls, capacity, error_rate, path, refresh_seconds=5.0):
+        bits, hashes = filter_size(capacity, error_rate)
+        size = HEADER_FORMAT.size + (bits + 7) // 8
+        header = HEADER_FORMAT.pack(FILTER_MAGIC, FILTER_VERSION, 0, bits, hashes, 0, 0.0, 0, 0, 0, 0)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as filter_file:
+            filter_file.write(header)
+            filter_file.truncate(size)
+        os.replace(tmp_path, path)
+        return cls.open(path, refresh_seconds)
+
+    @classmethod
+    def open(cls, path, refresh_seconds=5.0):
+        shared_file = open(path, 'r+b')
+        mm = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_WRITE)
+        return cls(mm, shared_file, refresh_seconds)
+
+    def positions(self, wallet_id):
+        digest = hashlib.blake2b(wallet_id.bytes, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    @contextmanager
+    def _locked(self):
+        """Блокировка записи: потоки процесса и другие процессы"""
+        with self._lock:
+            fcntl.flock(self.shared_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.shared_file, fcntl.LOCK_UN)
+
+    def add_many(self, wallet_ids):
+        offset = HEADER_FORMAT.size
+        added = 0
+        with self._locked():
+            for wallet_id in wallet_ids:
+                for position in self.positions(wallet_id):
+                    self.mm[offset + position // 8] |= 1 << (position % 8)
+                added += 1
+            self._set_header(added=self._header()[ADDED] + added)
+
+    def add(self, wallet_id):
+        self.add_many([wallet_id])
+
+    def __contains__(self, wallet_id):
+        offset = HEADER_FORMAT.size
+        return all(self.mm[offset + position // 8] & (1 << (position % 8)) for position in self.positions(wallet_id))
+
+    def might_contain(self, wallet_id):
+        """False - кошелька точно нет, True - нужно проверить в базе"""
+        self._count(CHECKS)
+        if wallet_id in self:
+            return True
+
+        if self.is_stale():
+            self.catch_up()
+            if wallet_id in self:
+                return True
+
+        self._count(REJECTED)
+        return False
+
+    def record_false_positive(self):
+        self._count(FALSE_POSITIVES)
+
+    def is_stale(self):
+        return time.time() - self._header()[SYNCED_AT] >= self.refresh_seconds
+
+    def catch_up(self):
+        """Догоняющий запрос при устаревшей синхронизации, один на все воркеры хоста.
+
+        Промахи остальных потоков и воркеров ждут блокировку, а получив ее, видят
+        свежее время синхронизации в заголовке и запрос не повторяют.
+        """
+        with self._refresh_lock:
+            fcntl.flock(self._refresh_file, fcntl.LOCK_EX)
+            try:
+                if self.is_stale():
+                    self.refresh()
+            finally:
+                fcntl.flock(self._refresh_file, fcntl.LOCK_UN)
+
+    def _count(self, index):
+        with self._stats_lock:
+            self._pending[index - CHECKS] += 1
+            flush = self._pending[0] >= STATS_FLUSH_EVERY
+        if flush:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Переносим счетчики процесса в общий заголовок"""
+        with self._locked():
+            with self._stats_lock:
+                pending, self._pending = self._pending, [0, 0, 0]
+            header = list(self._header())
+            for offset, value in enumerate(pending):
+                header[CHECKS + offset] += value
+            HEADER_FORMAT.pack_into(self.mm, 0, *header)
+
+    @property
+    def synced_at(self):
+        return datetime.fromtimestamp(self._header()[SYNCED_AT], tz=dt_timezone.utc)
+
+    def _header(self):
+        return HEADER_FORMAT.unpack_from(self.mm, 0)
+
+    def _set_header(self, synced_at=None, added=None):
+        header = list(self._header())
+        if synced_at is not None:
+            header[SYNCED_AT] = synced_at.timestamp()
+        if added is not None:
+            header[ADDED] = added
+        HEADER_FORMAT.pack_into(self.mm, 0, *header)
+
+    def refresh(self, full=False):
+        """Добавляем кошельки, созданные после последней синхронизации (или все, если full)"""
+        from wallet.models import Wallet
+
+        started = datetime.now(tz=dt_timezone.utc)
+        wallets = Wallet.objects.all()
+        if not full:
+            # time_update заполняется при создании кошелька (auto_now_add)
+            wallets = wallets.filter(time_update__gte=self.synced_at - SYNC_SKEW)
+
+        batch = []
+        for wallet_id in wallets.order_by().values_list('id', flat=True).iterator(chunk_size=BUILD_CHUNK_SIZE):
+            batch.append(wallet_id)
+            if len(batch) >= BUILD_CHUNK_SIZE:
+                self.add_many(batch)
+                batch = []
+        self.add_many(batch)
+
+        with self._locked():
+            self._set_header(synced_at=started)
+
+    def close(self):
+        self.mm.close()
+        self.shared_file.close()
+        self._refresh_file.close()
+
+    def stats(self):
+        """Заполнение фильтра и счетчики всех воркеров хоста.
+
+        Счетчики других воркеров видны с задержкой до STATS_FLUSH_EVERY проверок.
+        observed_false_positive_rate - доля пропущенных среди несуществующих
+        кошельков, ее можно сравнивать с expected_false_positive_rate.
+        """
+        self.flush_stats()
+        header = self._header()
+        set_bits = int.from_bytes(self.mm[HEADER_FORMAT.size:], 'little').bit_count()
+        fill = set_bits / self.bits
+        estimated = round(-self.bits / self.hashes * math.log(1 - fill)) if fill < 1 else None
+        checks, rejected, false_positives = header[CHECKS], header[REJECTED], header[FALSE_POSITIVES]
+        unknown = false_positives + rejected
+        return {
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'fill_ratio': round(fill, 6),
+            'added': header[ADDED],
+            'estimated_wallets': estimated,
+            'expected_false_positive_rate': fill ** self.hashes,
+            'synced_at': self.synced_at.isoformat(),
+            'checks': checks,
+            'rejected': rejected,
+            'passed': checks - rejected,
+            'false_positives': false_positives,
+            'observed_false_positive_rate': false_positives / unknown if unknown else 0.0,
+        }
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def build_wallet_filter(path):
+    """Открываем сохраненный фильтр или строим новый по таблице wallets.
+
+    Построение идет под файловой блокировкой, чтобы одновременно стартующие
+    воркеры не строили фильтр каждый сам.
+    """
+    from wallet.models import Wallet
+
+    refresh_seconds = settings.WALLET_FILTER_REFRESH_SECONDS
+    with open(f'{path}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        wallet_filter = None
+        if os.path.exists(path):
+            try:
+                wallet_filter = WalletFilter.open(path, refresh_seconds)
+            except ValueError:
+                # файл прежнего формата строим заново
+                pass
+            else:
+                wallet_filter.refresh()
+        if wallet_filter is None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            capacity = max(settings.WALLET_FILTER_CAPACITY, Wallet.objects.count() * 2)
+            wallet_filter = WalletFilter.create(capacity, settings.WALLET_FILTER_ERROR_RATE, path, refresh_seconds)
+            wallet_filter.refresh(full=True)
+    return wallet_filter
+
+
+def get_wallet_filter():
+    """Фильтр текущего процесса или None, если он выключен (WALLET_FILTER_ENABLED)"""
+    global _filter
+    if not settings.WALLET_FILTER_ENABLED:
+        return None
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                if not settings.WALLET_FILTER_PATH:
+                    raise ImproperlyConfigured('Для WALLET_FILTER_ENABLED нужен общий файл WALLET_FILTER_PATH')
+                _filter = build_wallet_filter(settings.WALLET_FILTER_PATH)
+    return _filter
+
+
+def open_wallet_filter():
+    """Открываем заранее построенный файл фильтра при старте процесса, без запросов в БД.
+
+    Если файла еще нет, фильтр построит первый запрос (get_wallet_filter).
+    """
+    global _filter
+    if settings.WALLET_FILTER_ENABLED and settings.WALLET_FILTER_PATH and os.path.exists(settings.WALLET_FILTER_PATH):
+        with _filter_lock:
+            if _filter is None:
+                try:
+                    _filter = WalletFilter.open(settings.WALLET_FILTER_PATH, settings.WALLET_FILTER_REFRESH_SECONDS)
+                except ValueError:
+                    # файл прежнего формата перестроит первый запрос
+                    pass
+
+
+def reset_wallet_filter():
+    global _filter
+    if _filter is not None:
+        _filter.close()
+    _filter = None
+
+
+# дочерний процесс (gunicorn --preload) открывает файл заново: блокировка flock
+# принадлежит открытому файлу, и унаследованный дескриптор был бы общим с родителем
+os.register_at_fork(after_in_child=reset_wallet_filter)
+
+
+def wallet_created(sender, instance, created, **kwargs):
+    """post_save: добавляем новый кошелек в уже построенный фильтр"""
+    if created and _filter is not None:
+        _filter.add(instance.pk)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wallet.archive import archive_operations
+
+
+class Command(BaseCommand):
+    help = ('Переносит операции старше срока хранения в сжатые zstd сегменты в WALLET_ARCHIVE_DIR. '
+            'История по ним остается доступной через api/v1/wallets/<uuid>/history')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.WALLET_ARCHIVE_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=500_000, help='Операций в одном сегменте')
+
+    def handle(self, *args, **options):
+        segments = archive_operations(retention_days=options['retention_days'], batch_size=options['batch_size'])
+        for path in segments:
+            self.stdout.write(f'Создан сегмент {path}')
+        self.stdout.write(self.style.SUCCESS(f'Создано сегментов: {len(segments)}'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from config.openapi import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Генерирует OpenAPI схему в OPENAPI_SCHEMA_PATH, откуда ее отдает /openapi.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.OPENAPI_SCHEMA_PATH))
+
+    def handle(self, *args, **options):
+        path = write_schema(options['output'])
+        self.stdout.write(self.style.SUCCESS(f'Схема сохранена в {path}'))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wallet.bloom import build_wallet_filter
+
+
+class Command(BaseCommand):
+    help = ('Строит (или догоняет) файл фильтра несуществующих кошельков WALLET_FILTER_PATH до старта воркеров, '
+            'чтобы воркеры открывали его через mmap без перестроения')
+
+    def handle(self, *args, **options):
+        if not settings.WALLET_FILTER_ENABLED:
+            self.stdout.write('Фильтр выключен, строить нечего')
+            return
+
+        stats = build_wallet_filter(settings.WALLET_FILTER_PATH).stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Фильтр {settings.WALLET_FILTER_PATH}: {stats['bits']} бит, {stats['hashes']} хешей, "
+            f"~{stats['estimated_wallets']} кошельков"))
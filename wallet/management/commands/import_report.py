@@ -0,0 +1,77 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Холодный старт воркера: WSGI приложение и первый запрос к API кошелька (загружает ROOT_URLCONF и views)
+WORKER_START = '''
+import json, resource, sys, time
+started = time.perf_counter()
+from config.wsgi import application
+from django.urls import resolve
+resolve('/api/v1/wallets/00000000-0000-0000-0000-000000000000')
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+    'heavy': {name: name in sys.modules for name in %r},
+}))
+'''
+
+# Модули, которые не должны загружаться при старте воркера и JSON запросах к API. django.contrib.admin.sites
+# сюда не входит: его импортирует пакет django.contrib.admin при загрузке INSTALLED_APPS. Маршруты админки
+# загружает любой reverse() (HTML ответ browsable API, страницы документации), это сценарий не проверяет
+HEAVY_MODULES = [
+    'drf_yasg.views', 'drf_yasg.generators', 'config.admin_urls', 'django.contrib.auth.admin', 'pandas', 'numpy',
+]
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = ('Отчет о времени импорта при холодном старте воркера (python -X importtime): '
+            'время старта, пиковая память, самые тяжелые пакеты и загруженные тяжелые модули')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Сколько раз запускать воркер для усреднения')
+        parser.add_argument('--top', type=int, default=15)
+
+    def run_worker(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', WORKER_START % HEAVY_MODULES],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        runs = [self.run_worker() for _ in range(options['runs'])]
+
+        self_time = defaultdict(int)
+        for line in runs[-1][1].splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                self_time[match.group(4).split('.')[0]] += int(match.group(1))
+
+        seconds = sorted(stats['seconds'] for stats, _ in runs)
+        stats = runs[-1][0]
+        self.stdout.write(f'Старт воркера: медиана {seconds[len(seconds) // 2]:.3f} с '
+                          f'(мин {seconds[0]:.3f} с, запусков {len(seconds)})')
+        self.stdout.write(f"Пиковая память: {stats['max_rss_kb'] / 1024:.1f} МБ, модулей: {stats['modules']}")
+        self.stdout.write(f'Импорт по пакетам (собственное время, всего {sum(self_time.values()) / 1000:.1f} мс):')
+        for package, micros in sorted(self_time.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {package:<30} {micros / 1000:8.1f} мс')
+
+        loaded = [name for name, is_loaded in stats['heavy'].items() if is_loaded]
+        if loaded:
+            self.stdout.write(self.style.WARNING(f"Загружены при старте: {', '.join(loaded)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Тяжелые модули документации и админки при старте не загружаются'))
+        self.stdout.write('Маршруты админки загрузятся при первом reverse(): HTML ответ browsable API, swagger, redoc')
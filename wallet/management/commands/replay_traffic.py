@@ -0,0 +1,245 @@
+import math
+import time
+import uuid
+from collections import Counter, defaultdict
+from decimal import Decimal
+from multiprocessing import Pool
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models.signals import post_save
+
+from wallet.models import Wallet
+from wallet.traffic import (
+    KIND_BALANCE, KIND_DEPOSIT, KIND_WITHDRAW, OPERATION_BY_KIND, cents_to_amount, read_traffic,
+    synthetic_traffic,
+)
+
+WALLET_URL = '{base_url}/api/v1/wallets/{wallet_id}'
+OPERATION_URL = '{base_url}/api/v1/wallets/{wallet_id}/operation'
+
+
+def percentile(sorted_values, q):
+    """Перцентиль методом ближайшего ранга по уже отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(round(q * len(sorted_values) / 100, 6)) - 1)
+    return sorted_values[rank]
+
+
+def fetch_balances(task):
+    """Читаем балансы кошельков через API (выполняется в процессе пула)"""
+    base_url, wallet_ids, timeout = task
+    balances = {}
+    with requests.Session() as session:
+        for wallet_id in wallet_ids:
+            try:
+                response = session.get(WALLET_URL.format(base_url=base_url, wallet_id=wallet_id), timeout=timeout)
+            except requests.RequestException:
+                balances[wallet_id] = None
+                continue
+            balances[wallet_id] = Decimal(response.json()['amount']) if response.status_code == 200 else None
+    return balances
+
+
+def send_requests(task):
+    """Отправляем свою часть плана, возвращаем (тип, кошелек, сумма, статус, задержка)"""
+    base_url, plan, start_at, speed, timeout = task
+    results = []
+    with requests.Session() as session:
+        # все процессы стартуют одновременно
+        time.sleep(max(0.0, start_at - time.time()))
+        for offset, kind, wallet_id, amount in plan:
+            if speed:
+                delay = start_at + offset / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            started = time.perf_counter()
+            try:
+                if kind == KIND_BALANCE:
+                    response = session.get(
+                        WALLET_URL.format(base_url=base_url, wallet_id=wallet_id), timeout=timeout)
+                else:
+                    response = session.post(
+                        OPERATION_URL.format(base_url=base_url, wallet_id=wallet_id),
+                        json={'operation_type': OPERATION_BY_KIND[kind], 'amount': str(cents_to_amount(amount))},
+                        timeout=timeout)
+                status_code = response.status_code
+            except requests.RequestException:
+                status_code = 0
+            results.append((kind, wallet_id, amount, status_code, time.perf_counter() - started))
+    return results
+
+
+def check_balances(results, initial, final):
+    """Сверяем балансы до и после прогона с успешными операциями.
+
+    Возвращает (не сошлись, исход неизвестен, нет в БД):
+    - кошельки, которых нет ни до, ни после (404 на неизвестный UUID), не проверяются;
+    - операции без ответа (таймаут, статус 0) сервер мог применить, поэтому такие
+      кошельки не считаются расхождением, а выносятся отдельно.
+    """
+    expected = defaultdict(Decimal)
+    unknown = set()
+    for kind, wallet_id, amount, status_code, _ in results:
+        if kind not in (KIND_DEPOSIT, KIND_WITHDRAW):
+            continue
+        if status_code == 0:
+            unknown.add(wallet_id)
+        elif status_code == 200:
+            expected[wallet_id] += cents_to_amount(amount) if kind == KIND_DEPOSIT else -cents_to_amount(amount)
+
+    mismatched, outcome_unknown, absent = [], [], []
+    for wallet_id, balance in initial.items():
+        final_balance = final.get(wallet_id)
+        if balance is None and final_balance is None:
+            absent.append(wallet_id)
+        elif wallet_id in unknown:
+            outcome_unknown.append(wallet_id)
+        elif balance is None or final_balance != balance + expected[wallet_id]:
+            mismatched.append(wallet_id)
+    return mismatched, outcome_unknown, absent
+
+
+class Command(BaseCommand):
+    help = ('Воспроизведение записанного трафика (WALLET_TRAFFIC_CAPTURE) или синтетической нагрузки '
+            'на API кошельков в несколько процессов с отчетом о задержках и проверкой балансов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--capture', help='Файл, записанный WalletTrafficCaptureMiddleware')
+        parser.add_argument('--speed', type=float, default=0.0,
+                            help='Сохранять интервалы записи с ускорением N (0 - без пауз)')
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--timeout', type=float, default=10.0)
+        parser.add_argument('--create-wallets', action='store_true',
+                            help='Создать недостающие кошельки в БД из настроек (она должна быть базой --base-url); '
+                                 'для синтетической нагрузки обязателен. Созданные кошельки удаляются после прогона')
+        parser.add_argument('--keep-wallets', action='store_true',
+                            help='Не удалять созданные кошельки после прогона')
+        parser.add_argument('--initial-balance', default='1000.00')
+
+        synthetic = parser.add_argument_group('синтетическая нагрузка (если не задан --capture)')
+        synthetic.add_argument('--requests', type=int, default=10000)
+        synthetic.add_argument('--wallets', type=int, default=1000)
+        synthetic.add_argument('--hot-fraction', type=float, default=0.01,
+                               help='Доля горячих кошельков')
+        synthetic.add_argument('--hot-share', type=float, default=0.9,
+                               help='Доля запросов к горячим кошелькам')
+        synthetic.add_argument('--withdraw-ratio', type=float, default=0.4)
+        synthetic.add_argument('--balance-ratio', type=float, default=0.2)
+        synthetic.add_argument('--rps', type=float, help='Целевая частота запросов (вместе с --speed 1)')
+        synthetic.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        processes = options['processes']
+        timeout = options['timeout']
+        initial_balance = Decimal(options['initial_balance'])
+
+        if options['capture']:
+            records = read_traffic(options['capture'])
+            if not records:
+                raise CommandError('Файл записи пуст')
+            wallet_ids = sorted({record.wallet_id for record in records})
+        else:
+            if not options['create_wallets']:
+                raise CommandError('Синтетической нагрузке нужны свои кошельки, добавьте --create-wallets')
+            wallet_ids = [uuid.uuid4() for _ in range(options['wallets'])]
+            records = synthetic_traffic(
+                wallet_ids, options['requests'],
+                hot_fraction=options['hot_fraction'],
+                hot_share=options['hot_share'],
+                withdraw_ratio=options['withdraw_ratio'],
+                balance_ratio=options['balance_ratio'],
+                rps=options['rps'],
+                seed=options['seed'],
+            )
+
+        created = self.create_wallets(wallet_ids, initial_balance) if options['create_wallets'] else []
+        try:
+            self.replay(records, wallet_ids, base_url, processes, timeout, options['speed'])
+        finally:
+            if created and not options['keep_wallets']:
+                connections.close_all()
+                for start in range(0, len(created), 1000):
+                    Wallet.objects.filter(id__in=created[start:start + 1000]).delete()
+                self.stdout.write(f'Удалено созданных кошельков: {len(created)}')
+
+    def replay(self, records, wallet_ids, base_url, processes, timeout, speed):
+        first_timestamp = records[0].timestamp
+        plan = [
+            (record.timestamp - first_timestamp, record.kind, str(record.wallet_id), record.amount)
+            for record in records
+            if record.kind in (KIND_BALANCE, KIND_DEPOSIT, KIND_WITHDRAW)
+        ]
+        wallet_keys = [str(wallet_id) for wallet_id in wallet_ids]
+
+        # соединения с БД не должны наследоваться процессами пула
+        connections.close_all()
+
+        with Pool(processes) as pool:
+            initial = self.balances(pool, base_url, wallet_keys, processes, timeout)
+
+            start_at = time.time() + 0.5
+            tasks = [(base_url, plan[i::processes], start_at, speed, timeout) for i in range(processes)]
+            results = [result for chunk in pool.map(send_requests, tasks) for result in chunk]
+            elapsed = time.time() - start_at
+
+            final = self.balances(pool, base_url, wallet_keys, processes, timeout)
+
+        self.report(results, elapsed, initial, final)
+
+    def create_wallets(self, wallet_ids, initial_balance):
+        """Создаем недостающие кошельки и возвращаем их id, чтобы удалить после прогона.
+
+        bulk_create не отправляет post_save, поэтому сигнал шлем сами - на него
+        подписан фильтр несуществующих кошельков.
+        """
+        existing = set(Wallet.objects.filter(id__in=wallet_ids).values_list('id', flat=True))
+        missing = [Wallet(id=wallet_id, amount=initial_balance) for wallet_id in wallet_ids
+                   if wallet_id not in existing]
+        Wallet.objects.bulk_create(missing, batch_size=1000)
+        for wallet in missing:
+            post_save.send(sender=Wallet, instance=wallet, created=True, raw=False, using='default', update_fields=None)
+        self.stdout.write(f'Создано кошельков: {len(missing)}')
+        return [wallet.id for wallet in missing]
+
+    @staticmethod
+    def balances(pool, base_url, wallet_keys, processes, timeout):
+        tasks = [(base_url, wallet_keys[i::processes], timeout) for i in range(processes)]
+        balances = {}
+        for chunk in pool.map(fetch_balances, tasks):
+            balances.update(chunk)
+        return balances
+
+    def report(self, results, elapsed, initial, final):
+        statuses = Counter(status_code for _, _, _, status_code, _ in results)
+        latencies = sorted(latency for *_, latency in results)
+        total = len(results)
+
+        mismatched, outcome_unknown, absent = check_balances(results, initial, final)
+        checked = len(initial) - len(absent) - len(outcome_unknown)
+
+        rejected = sum(count for code, count in statuses.items() if 400 <= code < 500)
+        errors = sum(count for code, count in statuses.items() if code == 0 or code >= 500)
+
+        self.stdout.write(f'Запросов: {total} за {elapsed:.2f} с, {total / elapsed if elapsed else 0:.1f} rps')
+        for q in (50, 99, 99.9):
+            self.stdout.write(f'p{q:g}: {percentile(latencies, q) * 1000:.2f} мс')
+        self.stdout.write(f'Статусы: {dict(sorted(statuses.items()))}')
+        self.stdout.write(f'Отклонено (4xx): {rejected / total if total else 0:.2%}')
+        self.stdout.write(f'Ошибки (5xx и сетевые): {errors / total if total else 0:.2%}')
+
+        if absent:
+            self.stdout.write(f'Кошельков нет в БД (не проверялись): {len(absent)}')
+        if outcome_unknown:
+            self.stdout.write(self.style.WARNING(
+                f'Исход операций неизвестен (нет ответа) у {len(outcome_unknown)} кошельков: {outcome_unknown[:10]}'))
+        if mismatched:
+            self.stdout.write(self.style.ERROR(
+                f'Балансы не сходятся у {len(mismatched)} из {checked} кошельков: {mismatched[:10]}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Балансы сходятся у всех {checked} проверенных кошельков'))
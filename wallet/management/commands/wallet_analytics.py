@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wallet.analytics import CHUNK_SIZE, build_report, write_report
+
+
+class Command(BaseCommand):
+    help = ('Досчитывает дневные агрегаты операций, распределение балансов и самые активные кошельки, '
+            'отчет сохраняется в WALLET_ANALYTICS_REPORT и отдается эндпоинтом api/v1/analytics')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Сколько активных кошельков выводить')
+        parser.add_argument('--active-days', type=int, default=7, help='Окно активности кошельков в днях')
+        parser.add_argument('--daily-days', type=int, default=30, help='Сколько дней дневной статистики в отчете')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--output', default=str(settings.WALLET_ANALYTICS_REPORT))
+
+    def handle(self, *args, **options):
+        report = build_report(
+            top=options['top'],
+            active_days=options['active_days'],
+            daily_days=options['daily_days'],
+            chunk_size=options['chunk_size'],
+        )
+        write_report(report, options['output'])
+
+        balances = report['balances']
+        self.stdout.write(f"Новых операций учтено: {report['processed_operations']}")
+        self.stdout.write(f"Кошельков: {balances['count']}, суммарный баланс: {balances['total']}")
+        self.stdout.write(self.style.SUCCESS(f"Отчет сохранен в {options['output']}"))
@@ -0,0 +1,71 @@
+import json
+import time
+from decimal import InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from wallet.apps import WalletConfig
+from wallet.traffic import KIND_BALANCE, KIND_BY_OPERATION, KIND_OTHER, TrafficRecord, amount_to_cents, get_writer
+
+# Записываются только маршруты, которые можно закодировать в TrafficRecord
+WALLET_PATH_PREFIX = '/api/v1/wallets/'
+CAPTURED_ROUTES = ('wallet_amount', 'wallet_operation')
+
+
+class WalletTrafficCaptureMiddleware:
+    """Запись последовательности и времени запросов к кошелькам в файл.
+
+    Включается настройкой WALLET_TRAFFIC_CAPTURE (путь к файлу записи),
+    записанный файл воспроизводится командой replay_traffic.
+    """
+
+    def __init__(self, get_response):
+        path = getattr(settings, 'WALLET_TRAFFIC_CAPTURE', None)
+        if not path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.writer = get_writer(path, getattr(settings, 'WALLET_TRAFFIC_CAPTURE_BUFFER', 256))
+
+    def __call__(self, request):
+        if not request.path_info.startswith(WALLET_PATH_PREFIX):
+            return self.get_response(request)
+
+        started = time.time()
+        start_counter = time.perf_counter()
+        # тело читаем до view, иначе DRF его уже прочитает как поток
+        body = request.body if request.method == 'POST' else b''
+        response = self.get_response(request)
+        duration_us = int((time.perf_counter() - start_counter) * 1_000_000)
+
+        match = request.resolver_match
+        if match is None or match.namespace != WalletConfig.name or match.url_name not in CAPTURED_ROUTES:
+            return response
+
+        if match.url_name == 'wallet_amount':
+            kind, amount = KIND_BALANCE, 0
+        else:
+            kind, amount = self.parse_operation(body)
+
+        # запись трафика не должна менять ответ API
+        try:
+            self.writer.write(TrafficRecord(
+                timestamp=started,
+                kind=kind,
+                wallet_id=match.kwargs['wallet_uuid'],
+                amount=amount,
+                status=response.status_code,
+                duration_us=duration_us,
+            ))
+        except Exception as e:
+            print(f"Error in WalletTrafficCaptureMiddleware: {str(e)}")
+        return response
+
+    @staticmethod
+    def parse_operation(body):
+        """Достаем тип операции и сумму из тела запроса, невалидные записываем как KIND_OTHER"""
+        try:
+            data = json.loads(body)
+            return KIND_BY_OPERATION[data['operation_type']], amount_to_cents(data['amount'])
+        except (ValueError, TypeError, KeyError, InvalidOperation, OverflowError):
+            return KIND_OTHER, 0
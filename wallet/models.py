@@ -35,7 +35,8 @@ class Wallet(models.Model):
                                  )
 
     time_update = models.DateTimeField(verbose_name='Дата и время последнего обновления',
-                                       auto_now_add=True)
+                                       auto_now_add=True,
+                                       db_index=True)
 
     at_create = models.DateTimeField(auto_now=True,
                                      verbose_name='дата создания кошелька')
@@ -55,3 +56,61 @@ class Wallet(models.Model):
         """Делаем так, чтобы перед сохранением автоматической валидации """
         self.full_clean()  # Вызывает clean() и валидаторы полей
         super().save(*args, **kwargs)
+
+
+class Operation(models.Model):
+    """История операций над кошельками. Пишется в той же транзакции, что и изменение баланса"""
+    wallet = models.ForeignKey(Wallet,
+                               on_delete=models.CASCADE,
+                               related_name='operations',
+                               verbose_name='Кошелек')
+
+    operation_type = models.CharField(max_length=8,
+                                      choices=Wallet.OPERATIONS_TYPE,
+                                      verbose_name='Тип операции')
+
+    amount = models.DecimalField(decimal_places=2,
+                                 max_digits=15,
+                                 verbose_name='Сумма операции')
+
+    created_at = models.DateTimeField(auto_now_add=True,
+                                      db_index=True,
+                                      verbose_name='Дата и время операции')
+
+    class Meta:
+        db_table = 'operations'
+        verbose_name = 'Операция'
+        verbose_name_plural = 'Операции'
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['wallet', 'created_at'])]
+
+
+class DailyOperationStats(models.Model):
+    """Дневные агрегаты операций, пополняются командой wallet_analytics"""
+    day = models.DateField(unique=True, verbose_name='День')
+    deposit_count = models.BigIntegerField(default=0, verbose_name='Количество пополнений')
+    deposit_volume = models.DecimalField(decimal_places=2, max_digits=20, default=Decimal('0.00'),
+                                         verbose_name='Объем пополнений')
+    withdraw_count = models.BigIntegerField(default=0, verbose_name='Количество снятий')
+    withdraw_volume = models.DecimalField(decimal_places=2, max_digits=20, default=Decimal('0.00'),
+                                          verbose_name='Объем снятий')
+
+    class Meta:
+        db_table = 'daily_operation_stats'
+        verbose_name = 'Дневная статистика'
+        verbose_name_plural = 'Дневная статистика'
+        ordering = ['-day']
+
+
+class RollupWatermark(models.Model):
+    """Единственная строка: граница по времени создания, до которой операции учтены в DailyOperationStats.
+
+    Строка блокируется (select_for_update) на весь пересчет, поэтому одновременные
+    запуски идут по очереди и не учитывают одни и те же операции дважды.
+    """
+    rolled_up_until = models.DateTimeField(null=True, blank=True, verbose_name='Учтены операции до')
+
+    class Meta:
+        db_table = 'rollup_watermark'
+        verbose_name = 'Граница дневной статистики'
+        verbose_name_plural = 'Граница дневной статистики'
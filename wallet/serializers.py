@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from decimal import Decimal
-from wallet.models import Wallet
+from wallet.models import Operation, Wallet
 
 
 class WalletSerializer(serializers.ModelSerializer):
@@ -27,3 +27,10 @@ class WalletOperationSerializer(serializers.Serializer):
         if value <= Decimal('0.00'):
             raise serializers.ValidationError("Сумма должна быть положительной")
         return value
+
+
+class OperationSerializer(serializers.ModelSerializer):
+    """Операция из истории кошелька. Работает и с записями из архива (ArchivedOperation)"""
+    class Meta:
+        model = Operation
+        fields = ["id", "operation_type", "amount", "created_at"]
@@ -2,16 +2,35 @@ import threading
 import uuid
 import time
 import atexit
-from django.db import transaction, connections
+import os
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+from datetime import timedelta
+from django.db import connection, transaction, connections
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Sum
 from decimal import Decimal
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 
 from rest_framework.test import APITestCase, APIClient
 
-from wallet.models import Wallet
+from django.utils import timezone
+
+from config.openapi import load_schema
+from wallet.bloom import WalletFilter, get_wallet_filter, reset_wallet_filter
+from wallet.archive import OperationArchive, archive_operations, balance_at, wallet_history
+from wallet import analytics
+from wallet.analytics import balance_distribution, top_active_wallets, update_daily_rollups
+from wallet.models import DailyOperationStats, Operation, Wallet
 from wallet.serializers import WalletSerializer, WalletOperationSerializer
+from wallet.traffic import (
+    KIND_BALANCE, KIND_DEPOSIT, KIND_OTHER, KIND_WITHDRAW, TrafficRecord, close_writer, pack_record, read_traffic,
+    synthetic_traffic, unpack_record,
+)
+from wallet.management.commands.replay_traffic import Command as ReplayCommand, check_balances, percentile
 
 
 class DatabaseCleanupMixin:
@@ -362,3 +381,414 @@ class SimpleConcurrentTests(TransactionTestCase, DatabaseCleanupMixin):
 
         self.wallet.refresh_from_db()
         self.assertEqual(self.wallet.amount, Decimal('1300.00'))
+
+
+class TrafficCaptureTests(APITestCase):
+    """Проверяем запись трафика и генератор нагрузки"""
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(amount=Decimal('100.00'))
+        fd, self.capture_path = tempfile.mkstemp(suffix='.wtrc')
+        os.close(fd)
+
+    def tearDown(self):
+        close_writer(self.capture_path)
+        os.remove(self.capture_path)
+
+    def test_record_roundtrip(self):
+        """Запись упаковывается и распаковывается без потерь"""
+        record = TrafficRecord(1700000000.5, KIND_DEPOSIT, self.wallet.id, 12345, 200, 1500)
+        self.assertEqual(unpack_record(pack_record(record)), record)
+
+    def test_middleware_capture(self):
+        """Middleware записывает запросы к кошелькам, но не другие маршруты"""
+        with override_settings(WALLET_TRAFFIC_CAPTURE=self.capture_path, WALLET_TRAFFIC_CAPTURE_BUFFER=1):
+            client = APIClient()
+            client.get(reverse('wallet:wallet_amount', kwargs={'wallet_uuid': self.wallet.id}))
+            client.post(reverse('wallet:wallet_operation', kwargs={'wallet_uuid': self.wallet.id}),
+                        {'operation_type': 'DEPOSIT', 'amount': '10.50'}, format='json')
+            client.post(reverse('wallet:wallet_operation', kwargs={'wallet_uuid': self.wallet.id}),
+                        {'operation_type': 'Чушь', 'amount': '1'}, format='json')
+            # суммы, не помещающиеся в запись, не должны превращать 400 в 500
+            oversized = [
+                client.post(reverse('wallet:wallet_operation', kwargs={'wallet_uuid': self.wallet.id}),
+                            body, content_type='application/json')
+                for body in ('{"operation_type": "DEPOSIT", "amount": Infinity}',
+                             '{"operation_type": "DEPOSIT", "amount": "1e30"}')
+            ]
+            client.get('/not-a-wallet/')
+            history = client.get(reverse('wallet:wallet_history', kwargs={'wallet_uuid': self.wallet.id}))
+            stats = client.get(reverse('wallet:wallet_filter_stats'))
+            analytics = client.get(reverse('wallet:analytics'))
+
+        self.assertEqual(history.status_code, status.HTTP_200_OK)
+        self.assertIn(stats.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertIn(analytics.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertEqual([response.status_code for response in oversized], [status.HTTP_400_BAD_REQUEST] * 2)
+        records = read_traffic(self.capture_path)
+        self.assertEqual([record.kind for record in records],
+                         [KIND_BALANCE, KIND_DEPOSIT, KIND_OTHER, KIND_OTHER, KIND_OTHER])
+        self.assertEqual(records[1].amount, 1050)
+        self.assertEqual(records[1].status, 200)
+        self.assertTrue(all(record.wallet_id == self.wallet.id for record in records))
+
+    def test_synthetic_hot_skew(self):
+        """Большая часть синтетических запросов приходится на горячие кошельки"""
+        wallet_ids = [uuid.uuid4() for _ in range(100)]
+        records = synthetic_traffic(wallet_ids, 2000, hot_fraction=0.05, hot_share=0.9, seed=1)
+        hot = set(wallet_ids[:5])
+        hot_requests = sum(record.wallet_id in hot for record in records)
+        self.assertEqual(len(records), 2000)
+        self.assertGreater(hot_requests / len(records), 0.85)
+
+    def test_percentile(self):
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 50), 500)
+        self.assertEqual(percentile(values, 99), 990)
+        self.assertEqual(percentile(values, 99.9), 999)
+
+    def test_replay_report(self):
+        """Неизвестные кошельки не проверяются, операции без ответа не считаются расхождением"""
+        results = [
+            (KIND_DEPOSIT, 'ok', 100, 200, 0.01),
+            (KIND_BALANCE, 'absent', 0, 404, 0.01),
+            (KIND_DEPOSIT, 'absent', 100, 404, 0.01),
+            (KIND_DEPOSIT, 'timeout', 100, 0, 10.0),
+            (KIND_WITHDRAW, 'broken', 100, 200, 0.01),
+        ]
+        initial = {'ok': Decimal('10.00'), 'absent': None, 'timeout': Decimal('10.00'), 'broken': Decimal('10.00')}
+        final = {'ok': Decimal('11.00'), 'absent': None, 'timeout': Decimal('11.00'), 'broken': Decimal('10.00')}
+
+        self.assertEqual(check_balances(results, initial, final), (['broken'], ['timeout'], ['absent']))
+
+        output = StringIO()
+        ReplayCommand(stdout=output).report(results, 1.0, initial, final)
+        self.assertIn('Кошельков нет в БД (не проверялись): 1', output.getvalue())
+        self.assertIn('Исход операций неизвестен (нет ответа) у 1 кошельков', output.getvalue())
+        self.assertIn("Балансы не сходятся у 1 из 2 кошельков: ['broken']", output.getvalue())
+
+
+class AnalyticsTests(APITestCase):
+    """Проверяем историю операций и аналитику"""
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(amount=Decimal('100.00'))
+        self.other_wallet = Wallet.objects.create(amount=Decimal('5000.00'))
+        self.operation_url = reverse('wallet:wallet_operation', kwargs={'wallet_uuid': self.wallet.id})
+
+    def test_operation_recorded(self):
+        """Успешная операция попадает в историю, отклоненная - нет"""
+        self.client.post(self.operation_url, {'operation_type': 'DEPOSIT', 'amount': '10.29'}, format='json')
+        self.client.post(self.operation_url, {'operation_type': 'WITHDRAW', 'amount': '9999.00'}, format='json')
+
+        operations = Operation.objects.filter(wallet=self.wallet)
+        self.assertEqual(operations.count(), 1)
+        self.assertEqual(operations[0].operation_type, 'DEPOSIT')
+        self.assertEqual(operations[0].amount, Decimal('10.29'))
+
+    def test_incremental_rollups(self):
+        """Повторный запуск учитывает только новые операции"""
+        Operation.objects.create(wallet=self.wallet, operation_type='DEPOSIT', amount=Decimal('10.29'))
+        Operation.objects.create(wallet=self.wallet, operation_type='WITHDRAW', amount=Decimal('5.00'))
+        self.assertEqual(update_daily_rollups(chunk_size=1, lag=timedelta(0)), 2)
+
+        Operation.objects.create(wallet=self.other_wallet, operation_type='DEPOSIT', amount=Decimal('0.71'))
+        self.assertEqual(update_daily_rollups(chunk_size=1, lag=timedelta(0)), 1)
+        self.assertEqual(update_daily_rollups(chunk_size=1, lag=timedelta(0)), 0)
+
+        stats = DailyOperationStats.objects.get()
+        self.assertEqual(stats.deposit_count, 2)
+        self.assertEqual(stats.deposit_volume, Decimal('11.00'))
+        self.assertEqual(stats.withdraw_count, 1)
+        self.assertEqual(stats.withdraw_volume, Decimal('5.00'))
+
+    def test_rollups_wait_for_late_commits(self):
+        """Операция с меньшим id, ставшая видимой позже, не теряется"""
+        late = Operation.objects.create(wallet=self.wallet, operation_type='DEPOSIT', amount=Decimal('1.00'))
+        committed = Operation.objects.create(wallet=self.wallet, operation_type='DEPOSIT', amount=Decimal('2.00'))
+        Operation.objects.filter(id=late.id).update(created_at=timezone.now() - timedelta(minutes=1))
+        Operation.objects.filter(id=committed.id).update(created_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(update_daily_rollups(lag=timedelta(minutes=5)), 1)
+        # прошло время, операция late вышла из окна ожидания
+        self.assertEqual(update_daily_rollups(lag=timedelta(0)), 1)
+
+        self.assertEqual(DailyOperationStats.objects.aggregate(total=Sum('deposit_count'))['total'], 2)
+
+    def test_balance_distribution(self):
+        Wallet.objects.create()
+        distribution = balance_distribution(chunk_size=2)
+
+        self.assertEqual(distribution['count'], 3)
+        self.assertEqual(distribution['total'], '5100.00')
+        self.assertEqual(distribution['min'], '0.00')
+        self.assertEqual(distribution['max'], '5000.00')
+        counts = {bucket['from']: bucket['count'] for bucket in distribution['buckets']}
+        self.assertEqual(counts['0.00'], 1)
+        self.assertEqual(counts['100.00'], 1)
+        self.assertEqual(counts['1000.00'], 1)
+
+    def test_top_active_wallets(self):
+        for _ in range(3):
+            Operation.objects.create(wallet=self.other_wallet, operation_type='DEPOSIT', amount=Decimal('1.00'))
+        Operation.objects.create(wallet=self.wallet, operation_type='DEPOSIT', amount=Decimal('1.00'))
+
+        top = top_active_wallets(limit=1, chunk_size=2)
+        self.assertFalse(top['approximate'])
+        self.assertEqual(top['wallets'], [{'id': str(self.other_wallet.id), 'operations': 3}])
+
+    def test_analytics_endpoint_admin_only(self):
+        response = self.client.get(reverse('wallet:analytics'))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+@skipUnless(connection.features.has_select_for_update, 'нужна блокировка строк (PostgreSQL)')
+class RollupConcurrencyTests(TransactionTestCase, DatabaseCleanupMixin):
+    """Одновременные пересчеты дневной статистики не учитывают операции дважды"""
+
+    def test_overlapping_runs_count_once(self):
+        wallet = Wallet.objects.create()
+        for amount in ('1.00', '2.00'):
+            Operation.objects.create(wallet=wallet, operation_type='DEPOSIT', amount=Decimal(amount))
+
+        results = []
+
+        def run():
+            try:
+                results.append(update_daily_rollups(lag=timedelta(0)))
+            finally:
+                connection.close()
+
+        second = threading.Thread(target=run)
+        iter_frames = analytics.iter_frames
+
+        def iter_frames_with_second_run(*args, **kwargs):
+            # второй запуск стартует с той же границей, пока первый читает операции
+            if not second.is_alive() and not results:
+                second.start()
+                second.join(timeout=1)
+            yield from iter_frames(*args, **kwargs)
+
+        with mock.patch('wallet.analytics.iter_frames', iter_frames_with_second_run):
+            results.append(update_daily_rollups(lag=timedelta(0)))
+            second.join()
+
+        self.assertEqual(sorted(results), [0, 2])
+        self.assertEqual(DailyOperationStats.objects.aggregate(total=Sum('deposit_count'))['total'], 2)
+
+
+class ArchiveTests(APITestCase):
+    """Проверяем архивацию истории операций в сегменты и чтение из них"""
+
+    def setUp(self):
+        self.archive_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(WALLET_ARCHIVE_DIR=self.archive_dir))
+
+        self.wallet = Wallet.objects.create(amount=Decimal('150.00'))
+        self.other_wallet = Wallet.objects.create()
+        now = timezone.now()
+        self.moments = [now - timedelta(days=200), now - timedelta(days=150), now - timedelta(days=1)]
+        for moment, operation_type, amount in zip(self.moments, ['DEPOSIT', 'WITHDRAW', 'DEPOSIT'],
+                                                  ['200.00', '70.55', '20.55']):
+            operation = Operation.objects.create(wallet=self.wallet, operation_type=operation_type,
+                                                 amount=Decimal(amount))
+            Operation.objects.filter(pk=operation.pk).update(created_at=moment)
+        Operation.objects.create(wallet=self.other_wallet, operation_type='DEPOSIT', amount=Decimal('1.00'))
+        Operation.objects.filter(wallet=self.other_wallet).update(created_at=self.moments[0])
+
+    def test_archive_moves_old_operations(self):
+        """Старые операции уходят в сегмент и удаляются из таблицы"""
+        segments = archive_operations(retention_days=90, batch_size=2)
+
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(Operation.objects.count(), 1)
+        archive = OperationArchive(self.archive_dir)
+        archived = archive.history(self.wallet.id)
+        archive.close()
+        self.assertEqual([operation.amount for operation in archived], [Decimal('200.00'), Decimal('70.55')])
+        self.assertEqual(archived[0].created_at, self.moments[0])
+
+    def test_archived_operations_rolled_up(self):
+        """Перед удалением из таблицы операции попадают в дневные агрегаты"""
+        archive_operations(retention_days=90)
+
+        totals = DailyOperationStats.objects.aggregate(deposits=Sum('deposit_count'), withdraws=Sum('withdraw_count'))
+        self.assertEqual(totals, {'deposits': 3, 'withdraws': 1})
+
+    def test_history_merges_archive(self):
+        """История и баланс на момент времени учитывают архив"""
+        archive_operations(retention_days=90)
+
+        history = wallet_history(self.wallet.id)
+        self.assertEqual([operation.operation_type for operation in history], ['DEPOSIT', 'WITHDRAW', 'DEPOSIT'])
+        self.assertEqual(len(wallet_history(self.wallet.id, since=self.moments[1])), 2)
+
+        self.assertEqual(balance_at(self.wallet, self.moments[0]), Decimal('200.00'))
+        self.assertEqual(balance_at(self.wallet, self.moments[1]), Decimal('129.45'))
+        self.assertEqual(balance_at(self.wallet, self.moments[0] - timedelta(seconds=1)), Decimal('0.00'))
+
+    def test_balance_skips_rows_pending_deletion(self):
+        """Строка, попавшая в сегмент, но еще не удаленная из таблицы, учитывается один раз"""
+        operation = Operation.objects.filter(wallet=self.wallet, created_at=self.moments[1]).get()
+        archive_operations(retention_days=90)
+        Operation.objects.bulk_create([operation])
+        Operation.objects.filter(pk=operation.pk).update(created_at=self.moments[1])
+
+        self.assertEqual(balance_at(self.wallet, self.moments[0]), Decimal('200.00'))
+
+    def test_history_endpoint(self):
+        archive_operations(retention_days=90)
+        url = reverse('wallet:wallet_history', kwargs={'wallet_uuid': self.wallet.id})
+
+        response = self.client.get(url, {'until': self.moments[1].isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['balance'], '129.45')
+        self.assertEqual([operation['amount'] for operation in response.data['operations']], ['200.00', '70.55'])
+
+        for params in ({'since': 'вчера'}, {'since': '2024-02-30T00:00:00Z'}, {'until': '2024-13-01'},
+                       {'limit': 0}, {'limit': 'все'}, {'after_id': 'x'}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_history_pages(self):
+        """Страницы истории по курсору next покрывают архив и таблицу без повторов"""
+        archive_operations(retention_days=90)
+        url = reverse('wallet:wallet_history', kwargs={'wallet_uuid': self.wallet.id})
+
+        amounts = []
+        response = self.client.get(url, {'limit': 2, 'until': timezone.now().isoformat()})
+        self.assertEqual(response.data['balance'], '150.00')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            amounts.extend(operation['amount'] for operation in response.data['operations'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+            self.assertIsNone(response.data['balance'])
+        self.assertEqual(amounts, ['200.00', '70.55', '20.55'])
+
+
+class WalletFilterTests(APITestCase):
+    """Проверяем фильтр Блума несуществующих кошельков"""
+
+    def setUp(self):
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'wallets.bloom')
+        self.enterContext(self.settings(
+            WALLET_FILTER_ENABLED=True, WALLET_FILTER_PATH=self.path, WALLET_FILTER_REFRESH_SECONDS=3600))
+        reset_wallet_filter()
+        self.addCleanup(reset_wallet_filter)
+        self.wallet = Wallet.objects.create(amount=Decimal('10.00'))
+
+    def open_worker_filter(self):
+        """Фильтр другого воркера того же хоста"""
+        wallet_filter = WalletFilter.open(self.path, refresh_seconds=3600)
+        self.addCleanup(wallet_filter.close)
+        return wallet_filter
+
+    def test_unknown_wallet_rejected_without_queries(self):
+        """Несуществующий кошелек отсеивается без запросов в БД в обоих эндпоинтах"""
+        get_wallet_filter()
+        unknown = uuid.uuid4()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('wallet:wallet_amount', kwargs={'wallet_uuid': unknown}))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.post(reverse('wallet:wallet_operation', kwargs={'wallet_uuid': unknown}),
+                                        {'operation_type': 'DEPOSIT', 'amount': '1.00'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get_wallet_filter().stats()['rejected'], 2)
+
+    def test_known_and_new_wallets_pass(self):
+        """Кошельки, созданные до и после построения фильтра, доступны"""
+        get_wallet_filter()
+        new_wallet = Wallet.objects.create()
+        for wallet in (self.wallet, new_wallet):
+            response = self.client.get(reverse('wallet:wallet_amount', kwargs={'wallet_uuid': wallet.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_new_wallet_visible_to_other_workers(self):
+        """Кошелек, созданный в одном воркере, сразу проходит фильтр другого воркера"""
+        get_wallet_filter()
+        other_worker = self.open_worker_filter()
+        new_wallet = Wallet.objects.create()
+        self.assertTrue(other_worker.might_contain(new_wallet.id))
+
+    def test_bulk_created_wallet_found_on_refresh(self):
+        """Кошелек, созданный в обход сигнала, проверяется в БД, когда синхронизация устарела"""
+        wallet_filter = get_wallet_filter()
+        bulk_wallet = Wallet(amount=Decimal('1.00'))
+        Wallet.objects.bulk_create([bulk_wallet])
+        wallet_filter.refresh_seconds = 0
+        self.assertTrue(wallet_filter.might_contain(bulk_wallet.id))
+
+    def test_catch_up_runs_once(self):
+        """При устаревшей синхронизации догоняющий запрос выполняет один воркер, второй видит свежий заголовок"""
+        first_worker = get_wallet_filter()
+        second_worker = self.open_worker_filter()
+        first_worker._set_header(synced_at=first_worker.synced_at - timedelta(hours=2))
+        self.assertTrue(second_worker.is_stale())
+
+        with self.assertNumQueries(1):
+            first_worker.catch_up()
+        with self.assertNumQueries(0):
+            second_worker.catch_up()
+
+    def test_stats_shared_between_workers(self):
+        """Счетчики общие для воркеров, доля ложных срабатываний - среди несуществующих кошельков"""
+        first_worker = get_wallet_filter()
+        second_worker = self.open_worker_filter()
+        first_worker.might_contain(self.wallet.id)
+        second_worker.might_contain(uuid.uuid4())
+        # кошелек прошел фильтр, но в базе не нашелся
+        second_worker.record_false_positive()
+        second_worker.flush_stats()
+
+        stats = first_worker.stats()
+        self.assertEqual((stats['checks'], stats['rejected'], stats['false_positives']), (2, 1, 1))
+        self.assertEqual(stats['observed_false_positive_rate'], 0.5)
+
+    def test_persisted_filter(self):
+        """Фильтр в файле переоткрывается без перестроения"""
+        get_wallet_filter()
+        reopened = self.open_worker_filter()
+        self.assertIn(self.wallet.id, reopened)
+        self.assertNotIn(uuid.uuid4(), reopened)
+
+    def test_filter_requires_shared_file(self):
+        with self.settings(WALLET_FILTER_PATH=''):
+            with self.assertRaises(ImproperlyConfigured):
+                get_wallet_filter()
+
+
+class OpenAPISchemaTests(APITestCase):
+    """Проверяем отдачу заранее собранной схемы и ленивые маршруты документации и админки"""
+
+    def setUp(self):
+        self.schema_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'openapi.json')
+        self.enterContext(self.settings(OPENAPI_SCHEMA_PATH=self.schema_path))
+        load_schema.cache_clear()
+        self.addCleanup(load_schema.cache_clear)
+
+    def test_schema_cached_with_etag(self):
+        """Схема отдается с кешированием, повторный запрос с ETag получает 304"""
+        response = self.client.get(reverse('openapi-schema'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('/wallets/{wallet_uuid}/operation', response.json()['paths'])
+
+        response = self.client.get(reverse('openapi-schema'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+
+    def test_docs_pages_load_prebuilt_schema(self):
+        """Swagger и ReDoc ссылаются на /openapi.json и сами схему не генерируют"""
+        for name, cache_control in (('schema-swagger-ui', 'private'), ('schema-redoc', 'public')):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(cache_control, response['Cache-Control'])
+            self.assertIn('max-age=3600', response['Cache-Control'])
+            self.assertIn(reverse('openapi-schema'), response.content.decode())
+        self.assertFalse(os.path.exists(self.schema_path))
+
+    def test_admin_routes(self):
+        self.assertEqual(self.client.get(reverse('admin:login')).status_code, status.HTTP_200_OK)
@@ -0,0 +1,168 @@
+"""Компактный бинарный формат записи трафика кошельков.
+
+Каждая запись имеет фиксированный размер, поэтому несколько воркеров gunicorn
+могут дописывать в один файл (O_APPEND), а чтение не требует разбора.
+Время хранится как unix timestamp, при воспроизведении считается смещение
+от первой записи.
+"""
+import atexit
+import os
+import random
+import struct
+import threading
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+
+# timestamp, тип запроса, UUID кошелька, сумма в копейках, HTTP статус, длительность в мкс
+RECORD_FORMAT = struct.Struct('<dB16sqHI')
+RECORD_SIZE = RECORD_FORMAT.size
+# диапазон поля суммы (q)
+CENTS_MIN, CENTS_MAX = -2 ** 63, 2 ** 63 - 1
+
+KIND_BALANCE = 0
+KIND_DEPOSIT = 1
+KIND_WITHDRAW = 2
+KIND_OTHER = 3
+
+KIND_BY_OPERATION = {
+    'DEPOSIT': KIND_DEPOSIT,
+    'WITHDRAW': KIND_WITHDRAW,
+}
+OPERATION_BY_KIND = {kind: operation for operation, kind in KIND_BY_OPERATION.items()}
+
+TrafficRecord = namedtuple(
+    'TrafficRecord',
+    ['timestamp', 'kind', 'wallet_id', 'amount', 'status', 'duration_us'],
+)
+
+
+def amount_to_cents(amount):
+    """Переводим сумму в копейки, чтобы хранить ее целым числом.
+
+    OverflowError - сумма бесконечна или не помещается в поле записи.
+    """
+    cents = int((Decimal(amount) * 100).to_integral_value())
+    if not CENTS_MIN <= cents <= CENTS_MAX:
+        raise OverflowError(f'Сумма {amount} не помещается в запись трафика')
+    return cents
+
+
+def cents_to_amount(cents):
+    return (Decimal(cents) / 100).quantize(Decimal('0.01'))
+
+
+def pack_record(record):
+    return RECORD_FORMAT.pack(
+        record.timestamp,
+        record.kind,
+        record.wallet_id.bytes,
+        record.amount,
+        min(record.status, 0xFFFF),
+        min(record.duration_us, 0xFFFFFFFF),
+    )
+
+
+def unpack_record(data):
+    timestamp, kind, wallet_bytes, amount, status, duration_us = RECORD_FORMAT.unpack(data)
+    return TrafficRecord(timestamp, kind, uuid.UUID(bytes=wallet_bytes), amount, status, duration_us)
+
+
+def read_traffic(path):
+    """Читаем все записи файла, отсортированные по времени.
+
+    Неполная запись в конце файла (воркер упал во время записи) пропускается.
+    """
+    records = []
+    with open(path, 'rb') as capture:
+        while True:
+            chunk = capture.read(RECORD_SIZE)
+            if len(chunk) < RECORD_SIZE:
+                break
+            records.append(unpack_record(chunk))
+    records.sort(key=lambda record: record.timestamp)
+    return records
+
+
+class TrafficWriter:
+    """Буферизированная запись трафика в файл.
+
+    Буфер сбрасывается одним вызовом os.write, файл открыт с O_APPEND,
+    так что записи разных процессов не перемешиваются внутри одной записи.
+    """
+
+    def __init__(self, path, buffer_records=256):
+        self.path = path
+        self.buffer_size = buffer_records * RECORD_SIZE
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        atexit.register(self.close)
+
+    def write(self, record):
+        with self._lock:
+            self._buffer += pack_record(record)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer and self._fd is not None:
+            os.write(self._fd, bytes(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path, buffer_records=256):
+    """Один TrafficWriter на файл в процессе, сколько бы middleware его ни открывали"""
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = TrafficWriter(path, buffer_records)
+        return _writers[path]
+
+
+def close_writer(path):
+    with _writers_lock:
+        writer = _writers.pop(path, None)
+    if writer is not None:
+        writer.close()
+
+
+def synthetic_traffic(wallet_ids, count, hot_fraction=0.01, hot_share=0.9,
+                      withdraw_ratio=0.4, balance_ratio=0.2, max_amount=100, rps=None, seed=None):
+    """Генерация синтетического потока запросов с перекосом на "горячие" кошельки.
+
+    hot_fraction - доля кошельков, считающихся горячими,
+    hot_share - доля запросов, приходящихся на горячие кошельки,
+    rps - если задан, записи получают равномерные отметки времени.
+    """
+    rng = random.Random(seed)
+    wallet_ids = list(wallet_ids)
+    hot_count = max(1, int(len(wallet_ids) * hot_fraction))
+    hot, cold = wallet_ids[:hot_count], wallet_ids[hot_count:] or wallet_ids[:hot_count]
+
+    records = []
+    for index in range(count):
+        wallet_id = rng.choice(hot if rng.random() < hot_share else cold)
+        roll = rng.random()
+        if roll < balance_ratio:
+            kind, amount = KIND_BALANCE, 0
+        else:
+            kind = KIND_WITHDRAW if roll < balance_ratio + withdraw_ratio else KIND_DEPOSIT
+            amount = rng.randint(1, max_amount * 100)
+        timestamp = index / rps if rps else 0.0
+        records.append(TrafficRecord(timestamp, kind, wallet_id, amount, 0, 0))
+    return records
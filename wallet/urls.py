@@ -1,7 +1,10 @@
 from django.urls import path
 
 from wallet.apps import WalletConfig
-from wallet.views import WalletDetailAPIView, WalletOperationsAPIView
+from wallet.views import (
+    WalletAnalyticsAPIView, WalletDetailAPIView, WalletFilterStatsAPIView, WalletHistoryAPIView,
+    WalletOperationsAPIView,
+)
 
 app_name = WalletConfig.name
 
@@ -9,4 +12,7 @@ app_name = WalletConfig.name
 urlpatterns = [
     path('api/v1/wallets/<uuid:wallet_uuid>', WalletDetailAPIView.as_view(), name='wallet_amount'),
     path('api/v1/wallets/<uuid:wallet_uuid>/operation', WalletOperationsAPIView.as_view(), name='wallet_operation'),
+    path('api/v1/wallets/<uuid:wallet_uuid>/history', WalletHistoryAPIView.as_view(), name='wallet_history'),
+    path('api/v1/analytics', WalletAnalyticsAPIView.as_view(), name='analytics'),
+    path('api/v1/wallet-filter/stats', WalletFilterStatsAPIView.as_view(), name='wallet_filter_stats'),
 ]
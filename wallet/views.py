@@ -1,18 +1,65 @@
+import json
+from functools import wraps
+
+from django.conf import settings
 from django.db.models import F
+from django.http import Http404
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db import transaction
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from wallet.models import Wallet
-from wallet.serializers import WalletSerializer, WalletOperationSerializer
+from wallet.archive import balance_at, wallet_history
+from wallet.bloom import get_wallet_filter
+from wallet.models import Operation, Wallet
+from wallet.serializers import OperationSerializer, WalletSerializer, WalletOperationSerializer
+
+# Операций на странице истории по умолчанию и максимум для ?limit=
+HISTORY_PAGE_SIZE = 500
+HISTORY_MAX_PAGE_SIZE = 5000
+
+
+def reject_unknown_wallet(handler):
+    """Отвечаем 404 без запроса в БД, если фильтр Блума знает, что такого кошелька нет.
+
+    Ставится поверх transaction.atomic, чтобы для отсеянного запроса не открывалось соединение.
+    """
+    @wraps(handler)
+    def wrapper(self, request, wallet_uuid, *args, **kwargs):
+        wallet_filter = get_wallet_filter()
+        if wallet_filter is not None and not wallet_filter.might_contain(wallet_uuid):
+            return Response(
+                {'error': 'Кошелек не найден'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return handler(self, request, wallet_uuid, *args, **kwargs)
+    return wrapper
+
+
+def get_wallet_or_404(wallet_uuid):
+    """get_object_or_404 с учетом ложных срабатываний фильтра"""
+    try:
+        return get_object_or_404(Wallet, pk=wallet_uuid)
+    except Http404:
+        record_false_positive()
+        raise
+
+
+def record_false_positive():
+    wallet_filter = get_wallet_filter()
+    if wallet_filter is not None:
+        wallet_filter.record_false_positive()
 
 
 class WalletDetailAPIView(APIView):
     """Get запрос, отпрвляем UUID кошелька, получаем """
+    @reject_unknown_wallet
     def get(self, request, wallet_uuid):
-        wallet = get_object_or_404(Wallet, pk=wallet_uuid)
+        wallet = get_wallet_or_404(wallet_uuid)
         serializer = WalletSerializer(wallet)
         return Response(serializer.data)
 
@@ -29,12 +76,14 @@ class WalletOperationsAPIView(APIView):
     Валидация UUID кошелька, а так же формата UUID.
 
     """
+    @reject_unknown_wallet
     @transaction.atomic
     def post(self, request, wallet_uuid):
         try:
             wallet = Wallet.objects.select_for_update().get(id=wallet_uuid)
 
         except Wallet.DoesNotExist:
+            record_false_positive()
             return Response(
                 {'error': 'Кошелек не найден'},
                 status=status.HTTP_404_NOT_FOUND
@@ -71,6 +120,8 @@ class WalletOperationsAPIView(APIView):
 
                 response_message = "Средства успешно сняты"
 
+            Operation.objects.create(wallet_id=wallet_uuid, operation_type=operation_type, amount=amount)
+
             wallet.refresh_from_db()
             response_serializer = WalletSerializer(wallet)
             return Response({
@@ -83,4 +134,96 @@ class WalletOperationsAPIView(APIView):
             return Response(
                 {'error': f'Ошибка при выполнении операции: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+class WalletHistoryAPIView(APIView):
+    """GET запрос, история операций кошелька за период ?since=&until= (ISO 8601).
+
+    Старые операции читаются из архива прозрачно. balance - баланс на момент until
+    (или текущий, если until не задан), считается только на первой странице.
+    Ответ отдается страницами по ?limit= операций, next - ссылка на следующую
+    страницу (курсор since + after_id).
+    """
+    @reject_unknown_wallet
+    def get(self, request, wallet_uuid):
+        wallet = get_wallet_or_404(wallet_uuid)
+
+        bounds = {}
+        for name in ('since', 'until'):
+            value = request.query_params.get(name)
+            if value is None:
+                continue
+            try:
+                moment = parse_datetime(value)
+            except ValueError:
+                # формат верный, но даты не существует (2024-02-30)
+                moment = None
+            if moment is None:
+                return Response(
+                    {'error': f'Неверный формат даты {name}, ожидается ISO 8601'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            bounds[name] = moment
+
+        try:
+            limit = int(request.query_params.get('limit', HISTORY_PAGE_SIZE))
+            after_id = request.query_params.get('after_id')
+            after_id = int(after_id) if after_id is not None else None
+        except ValueError:
+            limit = None
+        if limit is None or not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+            return Response(
+                {'error': f'limit и after_id должны быть целыми числами, limit от 1 до {HISTORY_MAX_PAGE_SIZE}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        operations = wallet_history(wallet.id, bounds.get('since'), bounds.get('until'), after_id, limit)
+        balance = None
+        if after_id is None:
+            balance = balance_at(wallet, bounds['until']) if 'until' in bounds else wallet.amount
+
+        next_url = None
+        if len(operations) == limit:
+            params = request.query_params.copy()
+            params['since'] = operations[-1].created_at.isoformat()
+            params['after_id'] = operations[-1].id
+            next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+        return Response({
+            'id': str(wallet.id),
+            'balance': str(balance) if balance is not None else None,
+            'operations': OperationSerializer(operations, many=True).data,
+            'next': next_url,
+        })
+
+
+class WalletAnalyticsAPIView(APIView):
+    """GET запрос, отдаем последний отчет аналитики, построенный командой wallet_analytics.
+
+    Отчет считается заранее, чтобы агрегаты не нагружали рабочую базу при каждом запросе.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            with open(settings.WALLET_ANALYTICS_REPORT, encoding='utf-8') as report_file:
+                return Response(json.load(report_file))
+        except FileNotFoundError:
+            return Response(
+                {'error': 'Отчет еще не построен, выполните manage.py wallet_analytics'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+
+class WalletFilterStatsAPIView(APIView):
+    """GET запрос, метрики фильтра несуществующих кошельков по всем воркерам хоста"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        wallet_filter = get_wallet_filter()
+        if wallet_filter is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, **wallet_filter.stats()})